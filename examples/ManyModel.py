@@ -25,17 +25,21 @@
 # change the size of the input image data, enable or disable LMS,
 # and enable or disable CUDA profiling to ease collection of profile data.
 #
-# This example uses randomly generated synthetic image data. The random
-# generation is intentionally not using GPU operations to avoid impacting
-# the memory usage profile of the model. Since random generated images
-# are being used this code should not be used as an example on how to
-# correctly and efficiently pipeline data using datasets, etc.
+# This example uses randomly generated synthetic image data. By default the
+# images are generated by a tf.data pipeline on the CPU, so that the data
+# generation neither limits the throughput at large image sizes nor impacts
+# the GPU memory usage profile of the model. The single threaded Python
+# generator of earlier versions remains available with
+# --data_source generator.
 #
 # Invocation examples:
 # Run without LMS:
 #   python ManyModel.py --image_size 2000
 # Run with LMS:
 #   python ManyModel.py --image_size 4000 --lms
+# Run with LMS on a CPU with 4 GB of memory:
+#   python ManyModel.py --image_size 1000 --lms --channels_last
+#       --lms_cpu_memory_limit_mb 4096
 
 
 import argparse
@@ -44,7 +48,9 @@ import tensorflow as tf
 import numpy as np
 import os
 from tensorflow.keras import backend as K
-from callbacks import CudaProfileCallback, LMSStatsLogger, LMSStatsAverage
+from keras_models import model_choices
+from callbacks import CudaProfileCallback, LMSStatsLogger, LMSStatsAverage, \
+    LMSTraceCallback
 
 # import Horovod if invoked with distribution
 hvd = None
@@ -53,22 +59,6 @@ if "OMPI_COMM_WORLD_RANK" in os.environ:
     hvd.init()
 
 #tf.logging.set_verbosity(tf.logging.INFO)
-model_choices = {'resnet50': tf.keras.applications.ResNet50,
-                 'resnet101': tf.keras.applications.ResNet101,
-                 'resnet152': tf.keras.applications.ResNet152,
-                 'resnet50v2': tf.keras.applications.ResNet50V2,
-                 'resnet101v2': tf.keras.applications.ResNet101V2,
-                 'resnet152v2': tf.keras.applications.ResNet152V2,
-                 'densenet121': tf.keras.applications.DenseNet121,
-                 'densenet169': tf.keras.applications.DenseNet169,
-                 'densenet201': tf.keras.applications.DenseNet201,
-                 'inception': tf.keras.applications.InceptionV3,
-                 'inceptionresnet': tf.keras.applications.InceptionResNetV2,
-                 'mobilenet': tf.keras.applications.MobileNet,
-                 'mobilenetv2': tf.keras.applications.MobileNetV2,
-                 'nasnetlarge': tf.keras.applications.NASNetLarge,
-                 'nasnetmobile': tf.keras.applications.NASNetMobile,
-                 'xception': tf.keras.applications.Xception}
 
 
 def random_image_generator(batch_size, num_classes, input_shape):
@@ -93,6 +83,43 @@ def random_image_generator(batch_size, num_classes, input_shape):
         yield(x_array, y_array)
 
 
+def random_image_dataset(batch_size, num_classes, input_shape, seed=0,
+                         num_parallel_calls=tf.data.experimental.AUTOTUNE,
+                         prefetch=2, device='cpu'):
+    # A tf.data version of random_image_generator that keeps up with the model
+    # at large image sizes. Each batch is generated directly at batch shape:
+    # uniform noise in [0, 2) plus an offset of twice the class, broadcast
+    # over each image. Like the templates of random_image_generator this
+    # keeps the content of an image dependent on its class, in the same
+    # range of [0, 2 * num_classes), without a gather of full size templates
+    # or any per-image work. The batches are made by parallel map workers
+    # and prefetched. Batch n is seeded by (seed, n), so the data is the same
+    # for a given seed whatever the number of workers.
+    #
+    # With device 'cpu' the images are generated in host memory, like those
+    # of random_image_generator, and the GPU memory profile of the model is
+    # unchanged. With device 'gpu' the batches are also prefetched into GPU
+    # memory, which hides the copy but holds prefetch batches there.
+    with tf.device('/cpu:0'):
+        def make_batch(n):
+            y = tf.random.stateless_uniform((batch_size,), seed=[seed, 2 * n],
+                                            maxval=num_classes, dtype=tf.int32)
+            offset = tf.reshape(2 * tf.cast(y, tf.float32),
+                                (batch_size,) + (1,) * len(input_shape))
+            x = tf.random.stateless_uniform((batch_size,) + input_shape,
+                                            seed=[seed, 2 * n + 1],
+                                            maxval=2) + offset
+            return x, tf.one_hot(y, num_classes)
+
+        dataset = tf.data.Dataset.range(tf.int64.max)
+        dataset = dataset.map(make_batch,
+                              num_parallel_calls=num_parallel_calls)
+        if device == 'gpu':
+            return dataset.apply(
+                tf.data.experimental.prefetch_to_device('/gpu:0', prefetch))
+        return dataset.prefetch(prefetch)
+
+
 
 def generate_stats_name(model, root):
     # Generates the name of the output stats file.
@@ -115,10 +142,22 @@ def get_callbacks(args):
                                              args.nvprof_start,
                                              args.nvprof_stop))
 
+    if args.lms_trace:
+        trace_filename = os.path.join(args.output_dir,
+                                      generate_stats_name(args.model, "lms_trace"))
+        trace_filename = os.path.splitext(trace_filename)[0] + '.bin'
+        callbacks.append(LMSTraceCallback(trace_filename,
+                                          args.nvprof_epoch,
+                                          args.nvprof_start,
+                                          args.nvprof_stop))
+
     if args.lms_stats:
         stats_filename = os.path.join(args.output_dir,
                                       generate_stats_name(args.model, "lms_stats"))
-        callbacks.append(LMSStatsLogger(stats_filename))
+        if args.lms_stats_format == 'columnar':
+            stats_filename = os.path.splitext(stats_filename)[0] + '.bin'
+        callbacks.append(LMSStatsLogger(stats_filename,
+                                        log_format=args.lms_stats_format))
 
     if args.lms_stats_average:
         stats_filename = os.path.join(args.output_dir,
@@ -131,9 +170,24 @@ def get_callbacks(args):
 
     return callbacks
 
+def set_lms_option(setter, value):
+    # Builds of older TensorFlow versions lack some of the LMS setters, so
+    # they are only called for the options given on the command line.
+    if not hasattr(tf.config.experimental, setter):
+        raise SystemExit('This TensorFlow build does not support %s' % setter)
+    getattr(tf.config.experimental, setter)(value)
+
 def run_model(args):
     if args.lms:
         tf.config.experimental.set_lms_enabled(True)
+        if args.lms_eviction_policy is not None:
+            set_lms_option('set_lms_eviction_policy', args.lms_eviction_policy)
+        if args.lms_cpu_memory_limit_mb:
+            set_lms_option('set_lms_cpu_memory_limit_mb',
+                           args.lms_cpu_memory_limit_mb)
+        if args.lms_cpu_swap_mb_per_sec:
+            set_lms_option('set_lms_cpu_swap_mb_per_sec',
+                           args.lms_cpu_swap_mb_per_sec)
 
     image_dim = args.image_size
     opt = tf.keras.optimizers.RMSprop()
@@ -168,11 +222,19 @@ def run_model(args):
     model.compile(optimizer=opt, loss='categorical_crossentropy',
                   experimental_run_tf_function=experimental_run_tf_function)
 
-    random_generator = random_image_generator(batch_size, num_classes,
-                                              input_shape)
-
-
-    model.fit(random_generator, steps_per_epoch=steps_per_epoch,
+    if args.data_source == 'generator':
+        random_data = random_image_generator(batch_size, num_classes,
+                                             input_shape)
+    else:
+        # Horovod: each process generates different images.
+        seed = args.data_seed + (hvd.rank() if hvd else 0)
+        random_data = random_image_dataset(batch_size, num_classes,
+                                           input_shape, seed=seed,
+                                           num_parallel_calls=args.data_workers,
+                                           prefetch=args.data_prefetch,
+                                           device=args.data_device)
+
+    model.fit(random_data, steps_per_epoch=steps_per_epoch,
               verbose=1 if not hvd or hvd.rank() == 0 else 0,
               epochs=args.epochs, callbacks=get_callbacks(args))
 
@@ -206,6 +268,19 @@ def main():
     lms_group.add_argument('--no-lms', dest='lms', action='store_false',
                            help='Disable LMS (Default)')
     parser.set_defaults(lms=False)
+    parser.add_argument('--lms_eviction_policy', default=None,
+                        choices=['fifo', 'lru', 'best_fit', 'first_inactive',
+                                 'largest_first', 'reuse_distance'],
+                        help='The policy LMS uses to choose the inactive '
+                             'tensor to swap out. (Default: the policy of '
+                             'the allocator, fifo)')
+    parser.add_argument('--lms_cpu_memory_limit_mb', type=int, default=0,
+                        help='With --lms, manage the memory of the CPU '
+                             'devices within this limit in MB. '
+                             '(Default 0, disabled)')
+    parser.add_argument('--lms_cpu_swap_mb_per_sec', type=int, default=0,
+                        help='The simulated bandwidth in MB/sec of the CPU '
+                             'device swaps. (Default 0, unlimited)')
 
     lms_stats = parser.add_mutually_exclusive_group(required=False)
     lms_stats.add_argument('--lms_stats', dest='lms_stats', action='store_true',
@@ -215,6 +290,11 @@ def main():
                            action='store_false',
                            help='Disable logging LMS per-step stats (Default)')
     parser.set_defaults(lms_stats=False)
+    parser.add_argument('--lms_stats_format', default='csv',
+                        choices=['csv', 'columnar'],
+                        help='Log the per-step stats as CSV or in the '
+                             'columnar format of lms_stats_log.py, to '
+                             '<modelName>_lms_stats.bin. (Default csv)')
 
     lms_stats_average = parser.add_mutually_exclusive_group(required=False)
     lms_stats_average.add_argument('--lms_stats_average',
@@ -237,6 +317,18 @@ def main():
                         help='The directory to write output files to.',)
 
 
+    lms_trace = parser.add_mutually_exclusive_group(required=False)
+    lms_trace.add_argument('--lms_trace', dest='lms_trace', action='store_true',
+                           help='Record an LMS event trace of the batches '
+                                'set by the nvprof_epoch, nvprof_start and '
+                                'nvprof_stop parameters to '
+                                '<output_dir>/<modelName>_lms_trace.bin. '
+                                'Convert it with lms_trace_to_chrome.py.')
+    lms_trace.add_argument('--no-lms_trace', dest='lms_trace',
+                           action='store_false',
+                           help='Disable the LMS event trace. (Default)')
+    parser.set_defaults(lms_trace=False)
+
     # nvprof parameters
     nvprof_group = parser.add_mutually_exclusive_group(required=False)
     nvprof_group.add_argument('--nvprof', dest='nvprof', action='store_true',
@@ -260,6 +352,27 @@ def main():
                         help='The batch in which to stop CUDA profiling. '
                              '(Default 9)')
 
+    # synthetic data parameters
+    parser.add_argument('--data_source', default='dataset',
+                        choices=['dataset', 'generator'],
+                        help='Generate the images with a parallel tf.data '
+                             'pipeline or with the single threaded Python '
+                             'generator. (Default dataset)')
+    parser.add_argument('--data_workers', type=int,
+                        default=tf.data.experimental.AUTOTUNE,
+                        help='The number of batches the dataset generates in '
+                             'parallel. (Default -1, tuned by tf.data)')
+    parser.add_argument('--data_prefetch', type=int, default=2,
+                        help='The number of batches the dataset prefetches. '
+                             '(Default 2)')
+    parser.add_argument('--data_seed', type=int, default=0,
+                        help='The seed of the dataset images. (Default 0)')
+    parser.add_argument('--data_device', default='cpu', choices=['cpu', 'gpu'],
+                        help='Keep the prefetched dataset batches in host '
+                             'memory, leaving the GPU memory profile of the '
+                             'model unchanged, or prefetch them into GPU '
+                             'memory. (Default cpu)')
+
     # channels first/last parameter
     ch_fl_group = parser.add_mutually_exclusive_group(required=False)
     ch_fl_group.add_argument('--channels_last', dest='channels_last',
@@ -273,7 +386,7 @@ def main():
     parser.set_defaults(channels_last=False)
 
     args = parser.parse_args()
-    if args.lms_stats or args.lms_stats_average:
+    if args.lms_stats or args.lms_stats_average or args.lms_trace:
         if not os.path.exists(args.output_dir):
             if hvd:
                 if hvd.local_rank() == 0:
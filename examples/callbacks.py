@@ -21,14 +21,29 @@ import statistics
 
 from tensorflow.keras.callbacks import Callback
 from tensorflow.estimator import SessionRunHook
+from lms_stats_log import StepStatsWriter
 
 _cudart = ctypes.CDLL('libcudart.so')
 nvtx=  ctypes.CDLL("libnvToolsExt.so")
 nvtx.nvtxMarkA.restype = None
 
-STATS_KEYS = ['time', 'allocs', 'reclaim_ones',
+STATS_KEYS = ['time', 'allocs', 'reclaim_ones', 'reclaim_fragments',
               'reclaim_alls', 'gib_reclaimed']
 
+# The allocator statistic each of the STATS_KEYS is taken from
+_ALLOCATOR_STATS = {'allocs': 'num_allocs',
+                    'reclaim_ones': 'num_single_reclaims',
+                    'reclaim_fragments': 'num_fragment_reclaims',
+                    'reclaim_alls': 'num_full_reclaims',
+                    'gib_reclaimed': 'bytes_reclaimed'}
+
+# The per-step log column of each of the STATS_KEYS
+_STEP_LOG_COLUMNS = {'time': 'duration', 'allocs': 'allocs',
+                     'reclaim_ones': 'reclaimOnes',
+                     'reclaim_fragments': 'reclaimFragments',
+                     'reclaim_alls': 'reclaimAlls',
+                     'gib_reclaimed': 'GiB reclaimed'}
+
 class CudaProfileCallback(Callback):
     def __init__(self, profile_epoch, profile_batch_start, profile_batch_end):
         self._epoch = profile_epoch - 1
@@ -49,6 +64,27 @@ class CudaProfileCallback(Callback):
         ret = nvtx.nvtxRangePop()
 
 
+class LMSTraceCallback(Callback):
+    def __init__(self, filename, trace_epoch, trace_batch_start,
+                 trace_batch_end, gpu_id=0):
+        self._filename = filename
+        self._epoch = trace_epoch - 1
+        self._start = trace_batch_start
+        self._end = trace_batch_end
+        self._gpu_id = gpu_id
+        self.epoch_keeper = 0
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_keeper = epoch
+    def on_batch_begin(self, batch, logs=None):
+        if batch == self._start and self.epoch_keeper == self._epoch:
+            print('Starting LMS trace')
+            tf.experimental.start_lms_trace(self._gpu_id)
+        if batch == self._end and self.epoch_keeper == self._epoch:
+            print('Stopping LMS trace, writing', self._filename)
+            tf.experimental.stop_lms_trace(self._gpu_id)
+            tf.experimental.dump_lms_trace(self._gpu_id, self._filename)
+
+
 class LMSStats():
 
     def __init__(self, gpu_id=0):
@@ -59,14 +95,27 @@ class LMSStats():
         self._cumulative_stats = self._start_stats.copy()
         self._num_steps = 0
         self._step_times = []
+        self._allocator_stats = {}
+
+    def _get_allocator_stats(self):
+        if hasattr(tf.experimental, 'get_allocator_stats'):
+            # One consistent snapshot of the allocator
+            snapshot = tf.experimental.get_allocator_stats([self._gpu_id])
+            return snapshot['gpu'].get(self._gpu_id, {})
+        # Older builds lack some of the getters, their stats are left out.
+        getters = {k: getattr(tf.experimental, 'get_' + k, None)
+                   for k in _ALLOCATOR_STATS.values()}
+        return {k: getter(self._gpu_id) for (k, getter) in getters.items()
+                if getter is not None}
 
     def _get_stats(self):
+        allocator_stats = self._get_allocator_stats()
+        self._allocator_stats = allocator_stats
         stats = {}
         stats['time'] = time.time()
-        stats['allocs'] = tf.experimental.get_num_allocs(self._gpu_id)
-        stats['reclaim_ones'] = tf.experimental.get_num_single_reclaims(self._gpu_id)
-        stats['reclaim_alls'] = tf.experimental.get_num_full_reclaims(self._gpu_id)
-        stats['gib_reclaimed'] = tf.experimental.get_bytes_reclaimed(self._gpu_id) / 1073741824.0
+        for key, name in _ALLOCATOR_STATS.items():
+            stats[key] = allocator_stats.get(name, -1)
+        stats['gib_reclaimed'] /= 1073741824.0
         return stats
 
     def step_begin(self):
@@ -105,35 +154,76 @@ class LMSStats():
             return 0
         return statistics.median(self._step_times)
 
-# writes the stats from the last call to step_end to the log file
-def write_step_stats(logfile, step_type, epoch, step_num, step_stats):
-        row = [step_type, epoch, step_num]
-        row.append(step_stats['time'])
-        row.append(step_stats['allocs'])
-        row.append(step_stats['reclaim_ones'])
-        row.append(step_stats['reclaim_alls'])
-        row.append(step_stats['gib_reclaimed'])
-        with open(logfile, 'a+', newline='') as csvfile:
-            statswriter = csv.writer(csvfile)
-            statswriter.writerow(row)
-
-
-def write_step_log_header(logfile):
-    with open(logfile, 'w', newline='') as csvfile:
-        statswriter = csv.writer(csvfile)
-        statswriter.writerow(['step type', 'epoch', 'step',
-                              'duration', 'allocs', 'reclaimOnes',
-                              'reclaimAlls', 'GiB reclaimed'])
+    def get_allocator_snapshot(self):
+        # All of the current allocator statistics, prefixed to keep them
+        # apart from the per-step stats.
+        return {'allocator_%s' % k: v
+                for (k, v) in self._get_allocator_stats().items()}
+
+    def get_last_allocator_snapshot(self):
+        # The allocator statistics taken by the last call to step_begin or
+        # step_end, prefixed like those of get_allocator_snapshot.
+        return {'allocator_%s' % k: v
+                for (k, v) in self._allocator_stats.items()}
+
+def step_log_row(step_type, epoch, step_num, lms_stats):
+    # The row of the last step of lms_stats: its differences in the
+    # _STEP_LOG_COLUMNS, then every allocator statistic at its end.
+    row = {'step type': step_type, 'epoch': epoch, 'step': step_num}
+    step_diff = lms_stats.get_last_step_difference()
+    for key in STATS_KEYS:
+        row[_STEP_LOG_COLUMNS[key]] = step_diff[key]
+    row.update(lms_stats.get_last_allocator_snapshot())
+    return row
 
 
 class LMSStatsLogger(Callback):
-    def __init__(self, logfile, gpu_id=0):
+    # Logs the stats of every step through a StepStatsWriter, which writes
+    # them in log_format from a background thread. The log is started by
+    # the first fit() or evaluate() the logger is used with, later ones
+    # append to it.
+    def __init__(self, logfile, gpu_id=0, log_format='csv', flush_rows=1000,
+                 flush_secs=10.0):
         self._epoch=0
         self._logfile = logfile
         self._lms_stats = LMSStats(gpu_id=gpu_id)
+        self._log_format = log_format
+        self._flush_rows = flush_rows
+        self._flush_secs = flush_secs
+        self._writer = None
+        self._started = False
+        self._training = False
+
+    def _open_writer(self):
+        if self._writer is None:
+            self._writer = StepStatsWriter(self._logfile, self._log_format,
+                                           self._flush_rows, self._flush_secs,
+                                           append=self._started)
+            self._started = True
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def on_train_begin(self, logs=None):
+        self._training = True
+        self._open_writer()
 
-    def set_params(self, params):
-        write_step_log_header(self._logfile)
+    def on_train_end(self, logs=None):
+        self._training = False
+        self._close_writer()
+
+    def on_test_begin(self, logs=None):
+        self._open_writer()
+
+    def on_test_end(self, logs=None):
+        # The validation of fit() is followed by more training steps, so
+        # the writer is only closed at the end of evaluate().
+        if self._training:
+            self._writer.flush()
+        else:
+            self._close_writer()
 
     def on_epoch_begin(self, epoch, logs=None):
         self._epoch = epoch
@@ -149,13 +239,13 @@ class LMSStatsLogger(Callback):
 
     def on_train_batch_end(self, batch, logs=None):
         self._lms_stats.step_end()
-        step_diff = self._lms_stats.get_last_step_difference()
-        write_step_stats(self._logfile, 't', self._epoch, batch, step_diff)
+        self._writer.write(step_log_row('t', self._epoch, batch,
+                                        self._lms_stats))
 
     def on_test_batch_end(self, batch, logs=None):
         self._lms_stats.step_end()
-        step_diff = self._lms_stats.get_last_step_difference()
-        write_step_stats(self._logfile, 'v', self._epoch, batch, step_diff)
+        self._writer.write(step_log_row('v', self._epoch, batch,
+                                        self._lms_stats))
 
 
 class LMSStatsTrainingStepsAverage(Callback):
@@ -185,14 +275,30 @@ class LMSStatsTrainingStepsAverage(Callback):
 
 
 class LMSStatsLoggerRunHook(SessionRunHook):
-    def __init__(self, logfile, gpu_id=0):
+    def __init__(self, logfile, gpu_id=0, log_format='csv', flush_rows=1000,
+                 flush_secs=10.0):
         self._logfile = logfile
         self._lms_stats = LMSStats(gpu_id=gpu_id)
         self._step = 0
+        self._log_format = log_format
+        self._flush_rows = flush_rows
+        self._flush_secs = flush_secs
+        self._writer = None
+        self._started = False
 
     # Estimator SessionRunHook methods
     def begin(self):
-        write_step_log_header(self._logfile)
+        # The hook of several train() calls appends to the log of the first
+        if self._writer:
+            self._writer.close()
+        self._writer = StepStatsWriter(self._logfile, self._log_format,
+                                       self._flush_rows, self._flush_secs,
+                                       append=self._started)
+        self._started = True
+
+    def end(self, session):
+        self._writer.close()
+        self._writer = None
 
     def before_run(self, run_context):
         self._lms_stats.step_begin()
@@ -200,8 +306,7 @@ class LMSStatsLoggerRunHook(SessionRunHook):
 
     def after_run(self, run_context, run_values):
         self._lms_stats.step_end()
-        step_diff = self._lms_stats.get_last_step_difference()
-        write_step_stats(self._logfile, 't', 0, self._step, step_diff)
+        self._writer.write(step_log_row('t', 0, self._step, self._lms_stats))
 
 
 class LMSStatsAverage(Callback):
@@ -266,9 +371,33 @@ class LMSStatsAverage(Callback):
         stats_dict[rate_field] = rate
         stats_dict[median_rate_field] = median_rate
 
-        write_header = not os.path.exists(self._logfile)
-        with open(self._logfile, 'a+', newline='') as csvfile:
+        allocator_stats = self._lms_stats.get_allocator_snapshot()
+        fieldnames.extend(sorted(allocator_stats))
+        stats_dict.update(allocator_stats)
+
+        rows = []
+        if os.path.exists(self._logfile):
+            with open(self._logfile, newline='') as csvfile:
+                reader = csv.DictReader(csvfile)
+                header = reader.fieldnames or []
+                if header == fieldnames:
+                    rows = None
+                else:
+                    # Written with other statistics, by another build for
+                    # instance. Its rows are rewritten with the columns of
+                    # both, rather than appending a row of another shape.
+                    rows = list(reader)
+                    fieldnames = header + [f for f in fieldnames
+                                           if f not in header]
+        if rows is None:
+            with open(self._logfile, 'a', newline='') as csvfile:
+                csv.DictWriter(csvfile, fieldnames=fieldnames).writerow(
+                    stats_dict)
+            return
+        temp = self._logfile + '.tmp'
+        with open(temp, 'w', newline='') as csvfile:
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            if write_header:
-                writer.writeheader()
+            writer.writeheader()
+            writer.writerows(rows)
             writer.writerow(stats_dict)
+        os.replace(temp, self._logfile)
@@ -0,0 +1,35 @@
+# Copyright 2018, 2020. IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+# The tf.keras.applications models the examples can build, by name.
+
+import tensorflow as tf
+
+model_choices = {'resnet50': tf.keras.applications.ResNet50,
+                 'resnet101': tf.keras.applications.ResNet101,
+                 'resnet152': tf.keras.applications.ResNet152,
+                 'resnet50v2': tf.keras.applications.ResNet50V2,
+                 'resnet101v2': tf.keras.applications.ResNet101V2,
+                 'resnet152v2': tf.keras.applications.ResNet152V2,
+                 'densenet121': tf.keras.applications.DenseNet121,
+                 'densenet169': tf.keras.applications.DenseNet169,
+                 'densenet201': tf.keras.applications.DenseNet201,
+                 'inception': tf.keras.applications.InceptionV3,
+                 'inceptionresnet': tf.keras.applications.InceptionResNetV2,
+                 'mobilenet': tf.keras.applications.MobileNet,
+                 'mobilenetv2': tf.keras.applications.MobileNetV2,
+                 'nasnetlarge': tf.keras.applications.NASNetLarge,
+                 'nasnetmobile': tf.keras.applications.NASNetMobile,
+                 'xception': tf.keras.applications.Xception}
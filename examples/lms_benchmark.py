@@ -0,0 +1,390 @@
+# Copyright 2020. IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+# Throughput regression benchmark for Large Model Support (LMS).
+#
+# The run command trains every combination of the given models, image sizes,
+# batch sizes and LMS settings with ManyModel.py, each in its own process so
+# that one configuration cannot leave GPU memory or allocator state behind
+# for the next. The LMSStatsAverage callback of each run supplies the median
+# megapixels/sec after the warmup steps and the allocator statistics. With
+# --repeats, the result keeps the rate and the statistics of every repeat
+# along with their medians. The results are kept in a JSON result store
+# under a label, for example the TensorFlow and LMS patch level under test.
+# Running a configuration again under the same label replaces its earlier
+# result.
+#
+# The report command compares the results of a label against those of a
+# baseline label, configuration by configuration, and lists the speedups
+# and the regressions. It exits with status 1 if there is a regression.
+#
+# With --dry_run the run command needs no GPU: each configuration is run by
+# lms_simulator.py instead of ManyModel.py. The predicted allocator
+# statistics are stored without a throughput, which checks the matrix, the
+# result store and the reports end to end.
+#
+# Invocation examples:
+#   python lms_benchmark.py run --label v2.1.0 --models resnet50 densenet201
+#       --image_sizes 2000 4000 --batch_sizes 1 2
+#   python lms_benchmark.py run --label v2.2.0 --models resnet50 densenet201
+#       --image_sizes 2000 4000 --batch_sizes 1 2
+#   python lms_benchmark.py report --label v2.2.0 --baseline v2.1.0
+
+import argparse
+import csv
+import glob
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RESULT_STORE_VERSION = 1
+RATE_FIELD = 'median megapixels/sec'
+EXAMPLES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def configurations(args):
+    lms_settings = {'on': [True], 'off': [False], 'both': [False, True]}
+    for (model, image_size, batch_size, lms) in itertools.product(
+            args.models, args.image_sizes, args.batch_sizes,
+            lms_settings[args.lms]):
+        yield {'model': model, 'image_size': image_size,
+               'batch_size': batch_size, 'lms': lms}
+
+
+def config_key(config):
+    return ('%s image_size=%d batch_size=%d lms=%s' %
+            (config['model'], config['image_size'], config['batch_size'],
+             'on' if config['lms'] else 'off'))
+
+
+def _to_number(value):
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _read_last_row(filename):
+    with open(filename, newline='') as csvfile:
+        rows = list(csv.DictReader(csvfile))
+    if not rows:
+        return None
+    return {k: _to_number(v) for (k, v) in rows[-1].items()}
+
+
+def _run_process(cmd, timeout):
+    print(' '.join(cmd))
+    try:
+        process = subprocess.run(cmd, cwd=EXAMPLES_DIR, timeout=timeout,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT,
+                                 universal_newlines=True)
+    except subprocess.TimeoutExpired:
+        return 'timed out after %d seconds' % timeout
+    if process.returncode:
+        # The tail of the output usually names the cause, an OOM for
+        # instance.
+        tail = process.stdout.strip().splitlines()[-5:]
+        return ('exit status %d: %s' %
+                (process.returncode, ' | '.join(tail)))
+    return None
+
+
+def run_training(args, config, output_dir):
+    cmd = [sys.executable, 'ManyModel.py',
+           '--model', config['model'],
+           '--image_size', str(config['image_size']),
+           '--batch_size', str(config['batch_size']),
+           '--lms' if config['lms'] else '--no-lms',
+           '--epochs', '1',
+           '--steps', str(args.warmup_steps + args.steps),
+           '--lms_stats_average',
+           '--lms_stats_warmup_steps', str(args.warmup_steps),
+           '--output_dir', output_dir]
+    if args.channels_last:
+        cmd.append('--channels_last')
+    error = _run_process(cmd, args.timeout)
+    if error:
+        return None, None, error
+    stats_files = glob.glob(os.path.join(output_dir,
+                                         '*_lms_stats_average.csv'))
+    stats = _read_last_row(stats_files[0]) if stats_files else None
+    if not stats:
+        return None, None, 'no statistics were written'
+    return stats.get(RATE_FIELD), stats, None
+
+
+def run_simulation(args, config, output_dir):
+    output = os.path.join(output_dir, 'simulation.csv')
+    cmd = [sys.executable, 'lms_simulator.py',
+           '--model', config['model'],
+           '--image_size', str(config['image_size']),
+           '--batch_size', str(config['batch_size']),
+           '--lms' if config['lms'] else '--no-lms',
+           '--gpu_memory_gb', str(args.gpu_memory_gb),
+           '--output', output]
+    if args.channels_last:
+        cmd.append('--channels_last')
+    error = _run_process(cmd, args.timeout)
+    if error:
+        return None, None, error
+    stats = _read_last_row(output)
+    if not stats:
+        return None, None, 'no simulation results were written'
+    return None, stats, None
+
+
+def median_stats(repeat_stats):
+    # The median of each numeric statistic over the repeats, the value of
+    # the first repeat for the others.
+    stats = {}
+    for key in repeat_stats[0]:
+        values = [s.get(key) for s in repeat_stats]
+        numbers = [v for v in values
+                   if isinstance(v, (int, float)) and not isinstance(v, bool)]
+        stats[key] = (statistics.median(numbers) if len(numbers) == len(values)
+                      else values[0])
+    return stats
+
+
+def run_configuration(args, config):
+    # Returns the result store entry of one configuration.
+    entry = {'config': config, 'label': args.label, 'dry_run': args.dry_run,
+             'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    run = run_simulation if args.dry_run else run_training
+    rates = []
+    repeat_stats = []
+    for _ in range(args.repeats):
+        with tempfile.TemporaryDirectory() as output_dir:
+            rate, stats, error = run(args, config, output_dir)
+        if error:
+            entry['status'] = 'failed'
+            entry['error'] = error
+            return entry
+        if rate is not None:
+            rates.append(rate)
+        repeat_stats.append(stats)
+    entry['status'] = 'ok'
+    entry[RATE_FIELD] = statistics.median(rates) if rates else None
+    entry['rates'] = rates
+    entry['stats'] = median_stats(repeat_stats)
+    entry['repeat_stats'] = repeat_stats
+    return entry
+
+
+def tensorflow_version():
+    # Asked of a separate process so that this one never touches the GPU.
+    try:
+        return subprocess.check_output(
+            [sys.executable, '-c',
+             'import tensorflow as tf; print(tf.__version__)'],
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_store(filename):
+    if not os.path.exists(filename):
+        return {'version': RESULT_STORE_VERSION, 'results': []}
+    with open(filename) as f:
+        store = json.load(f)
+    if store.get('version') != RESULT_STORE_VERSION:
+        raise ValueError('%s is version %s of the result store, this script '
+                         'reads version %d' % (filename, store.get('version'),
+                                               RESULT_STORE_VERSION))
+    return store
+
+
+def save_store(filename, store):
+    # Write a new file and move it into place so that an interrupted run
+    # cannot leave a truncated store behind.
+    temp = filename + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(store, f, indent=1, sort_keys=True)
+    os.replace(temp, filename)
+
+
+def add_result(store, entry):
+    key = config_key(entry['config'])
+    store['results'] = [r for r in store['results']
+                        if not (r['label'] == entry['label'] and
+                                config_key(r['config']) == key)]
+    store['results'].append(entry)
+
+
+def results_by_config(store, label):
+    return {config_key(r['config']): r for r in store['results']
+            if r['label'] == label and r['status'] == 'ok'}
+
+
+def _bytes_reclaimed(entry):
+    stats = entry.get('stats') or {}
+    return stats.get('allocator_bytes_reclaimed',
+                     stats.get('bytes_reclaimed'))
+
+
+def compare(current, baseline, threshold):
+    # Returns a report row of one configuration and whether it regressed.
+    row = {'baseline ' + RATE_FIELD: baseline.get(RATE_FIELD),
+           RATE_FIELD: current.get(RATE_FIELD),
+           'speedup': None,
+           'baseline bytes_reclaimed': _bytes_reclaimed(baseline),
+           'bytes_reclaimed': _bytes_reclaimed(current)}
+    regressed = False
+    if row[RATE_FIELD] and row['baseline ' + RATE_FIELD]:
+        row['speedup'] = row[RATE_FIELD] / row['baseline ' + RATE_FIELD]
+        regressed = row['speedup'] < 1.0 - threshold
+    return row, regressed
+
+
+def report(args):
+    store = load_store(args.store)
+    current = results_by_config(store, args.label)
+    baseline = results_by_config(store, args.baseline)
+    if not current:
+        sys.exit('There are no results labelled %s in %s' %
+                 (args.label, args.store))
+
+    rows = []
+    regressions = []
+    for key in sorted(current):
+        if key not in baseline:
+            print('%s: no %s result to compare with' % (key, args.baseline))
+            continue
+        row, regressed = compare(current[key], baseline[key], args.threshold)
+        row['configuration'] = key
+        row['regression'] = regressed
+        rows.append(row)
+        if regressed:
+            regressions.append(key)
+        speedup = row['speedup']
+        print('%s: %s%s' % (key,
+                            'speedup %.3f' % speedup if speedup is not None
+                            else 'no throughput',
+                            ' REGRESSION' if regressed else ''))
+
+    failed = [config_key(r['config']) for r in store['results']
+              if r['label'] == args.label and r['status'] != 'ok']
+    for key in failed:
+        print('%s: failed' % key)
+
+    if args.output and rows:
+        fieldnames = ['configuration', 'speedup', 'regression',
+                      'baseline ' + RATE_FIELD, RATE_FIELD,
+                      'baseline bytes_reclaimed', 'bytes_reclaimed']
+        with open(args.output, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    if regressions:
+        print('%d of %d configurations are more than %.0f%% slower than %s' %
+              (len(regressions), len(rows), args.threshold * 100,
+               args.baseline))
+        sys.exit(1)
+
+
+def run(args):
+    store = load_store(args.store)
+    version = tensorflow_version()
+    for config in configurations(args):
+        entry = run_configuration(args, config)
+        entry['tensorflow_version'] = version
+        if entry['status'] == 'ok':
+            print('%s: %s %s' % (config_key(config), RATE_FIELD,
+                                 entry[RATE_FIELD]))
+        else:
+            print('%s: failed, %s' % (config_key(config), entry['error']))
+        add_result(store, entry)
+        # Save after every configuration so an interrupted matrix keeps
+        # the results it has.
+        save_store(args.store, store)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', default='lms_benchmark_results.json',
+                        help='The JSON result store. '
+                             '(Default lms_benchmark_results.json)')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser('run',
+        help='Run the benchmark matrix and store the results.')
+    run_parser.add_argument('--label', required=True,
+                            help='The label to store the results under, '
+                                 'for example the patch level under test.')
+    run_parser.add_argument('--models', nargs='+', default=['resnet50'],
+                            help='The ManyModel.py models to run. '
+                                 '(Default resnet50)')
+    run_parser.add_argument('--image_sizes', type=int, nargs='+',
+                            default=[500],
+                            help='The image sizes to run. (Default 500)')
+    run_parser.add_argument('--batch_sizes', type=int, nargs='+',
+                            default=[1],
+                            help='The batch sizes to run. (Default 1)')
+    run_parser.add_argument('--lms', choices=['on', 'off', 'both'],
+                            default='both',
+                            help='Run with LMS, without LMS or both. '
+                                 '(Default both)')
+    run_parser.add_argument('--warmup_steps', type=int, default=5,
+                            help='The steps to train before measuring. '
+                                 '(Default 5)')
+    run_parser.add_argument('--steps', type=int, default=10,
+                            help='The steps to measure. (Default 10)')
+    run_parser.add_argument('--repeats', type=int, default=1,
+                            help='The processes to run per configuration. '
+                                 'The results of each are stored along '
+                                 'with their medians. (Default 1)')
+    run_parser.add_argument('--timeout', type=int, default=3600,
+                            help='The seconds a configuration may run. '
+                                 '(Default 3600)')
+    run_parser.add_argument('--gpu_memory_gb', type=float, default=15.0,
+                            help='The GPU memory to simulate with '
+                                 '--dry_run in GiB. (Default 15.0)')
+    run_parser.add_argument('--channels_last', action='store_true',
+                            help='Create the models and images with '
+                                 'channels last.')
+    run_parser.add_argument('--dry_run', action='store_true',
+                            help='Simulate the configurations with '
+                                 'lms_simulator.py instead of training '
+                                 'them; needs no GPU.')
+    run_parser.set_defaults(func=run)
+
+    report_parser = subparsers.add_parser('report',
+        help='Compare the results of a label with those of a baseline.')
+    report_parser.add_argument('--label', required=True,
+                               help='The label of the results to check.')
+    report_parser.add_argument('--baseline', required=True,
+                               help='The label of the baseline results.')
+    report_parser.add_argument('--threshold', type=float, default=0.05,
+                               help='The slowdown reported as a '
+                                    'regression. (Default 0.05)')
+    report_parser.add_argument('--output',
+                               help='A CSV file to write the report to.')
+    report_parser.set_defaults(func=report)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
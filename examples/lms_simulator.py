@@ -0,0 +1,565 @@
+# Copyright 2020. IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+# This tool predicts, without a GPU, how a ManyModel.py model will use GPU
+# memory with Large Model Support (LMS). It builds the model, traces the
+# graph of a training step, and replays the tensors of the graph in op order
+# against a Python model of the GPU BFC allocator with LMS: the best-fit
+# allocation from free chunks, splitting and coalescing, the reclaim list of
+# inactive tensors, the single, fragment and full reclaims, and the page-out
+# prediction history.
+#
+# The replay is an estimate. It runs the ops one at a time in the order they
+# were created and does not model the temporary memory of kernels, so the
+# real peak usage is somewhat higher. Tensors of ops that only change the
+# shape of their input share the input's memory. The model variables and
+# the optimizer slots are resident for the whole run.
+#
+# Invocation examples:
+#   python lms_simulator.py --model densenet201 --image_size 6000
+#   python lms_simulator.py --model resnet50 --image_size 2000 4000 6000 8000
+#       --gpu_memory_gb 16 --output resnet50_sweep.csv
+
+import argparse
+import bisect
+import collections
+import csv
+
+import tensorflow as tf
+
+from keras_models import model_choices
+
+# The BFC allocator rounds allocations to multiples of 256 bytes and leaves
+# a free chunk unsplit when the remainder is small.
+MIN_ALLOCATION_SIZE = 256
+MAX_INTERNAL_FRAGMENTATION = 128 << 20
+
+# Ops whose output is a view of their first input.
+ALIAS_OPS = {'Identity', 'IdentityN', 'Reshape', 'Squeeze', 'ExpandDims',
+             'StopGradient', 'Snapshot', 'EnsureShape'}
+
+REPORT_KEYS = ['image_size', 'fits', 'peak_bytes_in_use', 'peak_bytes_active',
+               'bytes_reclaimed', 'bytes_paged_in', 'num_single_reclaims',
+               'num_fragment_reclaims', 'num_full_reclaims',
+               'pageout_predictions', 'pageout_prediction_hits',
+               'pageout_prediction_misses', 'pageout_prediction_wrong',
+               'pageout_predictions_gated', 'pcie_seconds']
+
+
+class ReclaimHistory():
+    # Python port of LMSReclaimHistory: per step the outcome of each time a
+    # tensor became inactive, True if it was reclaimed before its next use.
+    # The past steps vote on a prediction while their outcomes match those
+    # of the current step within the tolerance, recent steps weigh more.
+
+    CONFIDENCE_RATE = 0.125
+
+    def __init__(self):
+        self.current = []
+        self.past = []
+        self.mismatches = []
+        self.predicted = False
+        self.confidence = 1.0
+
+    def record(self, reclaimed):
+        if self.predicted:
+            self.confidence += self.CONFIDENCE_RATE * (float(reclaimed) -
+                                                       self.confidence)
+        self.predicted = False
+        n = len(self.current)
+        for s, past in enumerate(self.past):
+            if n >= len(past) or past[n] != reclaimed:
+                self.mismatches[s] += 1
+        self.current.append(reclaimed)
+
+    def reset(self, history_steps):
+        if self.current:
+            self.past.insert(0, self.current)
+            del self.past[history_steps:]
+        self.current = []
+        self.mismatches = [0] * len(self.past)
+
+    def predict(self, match_tolerance):
+        n = len(self.current)
+        votes = weights = 0.0
+        for s, past in enumerate(self.past):
+            if n >= len(past) or self.mismatches[s] > match_tolerance * n:
+                continue
+            weight = 1.0 / (s + 1)
+            weights += weight
+            if past[n]:
+                votes += weight
+        return weights > 0 and votes > 0.5 * weights
+
+
+class Chunk():
+    __slots__ = ['offset', 'size', 'tensor', 'prev', 'next']
+
+    def __init__(self, offset, size):
+        self.offset = offset
+        self.size = size
+        self.tensor = None
+        self.prev = None
+        self.next = None
+
+
+class Tensor():
+    __slots__ = ['name', 'size', 'chunk', 'state', 'seq']
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.chunk = None
+        self.state = 'active'
+        self.seq = 0
+
+
+class BFCAllocatorModel():
+    # A single region of memory_limit bytes, like the GPU BFC allocator
+    # without allow_growth. Free chunks are kept ordered by (size, offset),
+    # which finds the same chunk as the bin search of the allocator.
+
+    def __init__(self, memory_limit, lms_enabled=True, history_steps=1,
+                 match_tolerance=0.0, min_confidence=0.0):
+        self.memory_limit = memory_limit
+        self.lms_enabled = lms_enabled
+        self.history_steps = max(history_steps, 1)
+        self.match_tolerance = match_tolerance
+        self.min_confidence = min_confidence
+        first = Chunk(0, memory_limit)
+        self.free_chunks = [(first.size, first.offset)]
+        self.chunks = {first.offset: first}
+        self.reclaim_list = collections.OrderedDict()
+        self.reclaim_seq = 0
+        self.history = collections.defaultdict(ReclaimHistory)
+        self.stats = collections.Counter()
+
+    # Chunks
+    def _remove_free(self, chunk):
+        i = bisect.bisect_left(self.free_chunks, (chunk.size, chunk.offset))
+        del self.free_chunks[i]
+
+    def _insert_free(self, chunk):
+        bisect.insort(self.free_chunks, (chunk.size, chunk.offset))
+
+    def _find_chunk(self, rounded_bytes):
+        i = bisect.bisect_left(self.free_chunks, (rounded_bytes, -1))
+        if i == len(self.free_chunks):
+            return None
+        chunk = self.chunks[self.free_chunks[i][1]]
+        self._remove_free(chunk)
+        remainder = chunk.size - rounded_bytes
+        if chunk.size >= rounded_bytes * 2 or remainder >= MAX_INTERNAL_FRAGMENTATION:
+            rest = Chunk(chunk.offset + rounded_bytes, remainder)
+            rest.prev = chunk
+            rest.next = chunk.next
+            if chunk.next:
+                chunk.next.prev = rest
+            chunk.next = rest
+            chunk.size = rounded_bytes
+            self.chunks[rest.offset] = rest
+            self._insert_free(rest)
+        return chunk
+
+    def _free_chunk(self, chunk):
+        chunk.tensor = None
+        self.stats['bytes_in_use'] -= chunk.size
+        for neighbor in (chunk.prev, chunk.next):
+            if neighbor is not None and neighbor.tensor is None:
+                self._remove_free(neighbor)
+        if chunk.next is not None and chunk.next.tensor is None:
+            self._merge(chunk, chunk.next)
+        if chunk.prev is not None and chunk.prev.tensor is None:
+            chunk = self._merge(chunk.prev, chunk)
+        self._insert_free(chunk)
+
+    def _merge(self, first, second):
+        first.size += second.size
+        first.next = second.next
+        if second.next:
+            second.next.prev = first
+        del self.chunks[second.offset]
+        return first
+
+    # Allocation
+    def allocate(self, tensor):
+        rounded_bytes = max(MIN_ALLOCATION_SIZE,
+                            -(-tensor.size // MIN_ALLOCATION_SIZE) * MIN_ALLOCATION_SIZE)
+        chunk = self._find_chunk(rounded_bytes)
+        if chunk is None and self.lms_enabled:
+            chunk = self._reclaim_chunk(rounded_bytes)
+        if chunk is None:
+            return False
+        chunk.tensor = tensor
+        tensor.chunk = chunk
+        self.stats['bytes_in_use'] += chunk.size
+        self.stats['peak_bytes_in_use'] = max(self.stats['peak_bytes_in_use'],
+                                              self.stats['bytes_in_use'])
+        self._update_peak_active()
+        return True
+
+    def free(self, tensor):
+        if tensor.state == 'inactive':
+            self._remove_inactive(tensor)
+            self._record(tensor, False)
+        if tensor.state != 'reclaimed':
+            self._free_chunk(tensor.chunk)
+        tensor.chunk = None
+
+    def _update_peak_active(self):
+        active = self.stats['bytes_in_use'] - self.stats['bytes_inactive']
+        self.stats['peak_bytes_active'] = max(self.stats['peak_bytes_active'],
+                                              active)
+
+    # Inactive tensors
+    def unpin(self, tensor):
+        tensor.state = 'inactive'
+        tensor.seq = self.reclaim_seq
+        self.reclaim_seq += 1
+        self.reclaim_list[tensor] = None
+        self.stats['bytes_inactive'] += tensor.chunk.size
+        history = self.history[tensor.name]
+        history.predicted = history.predict(self.match_tolerance)
+        if history.predicted:
+            self.stats['pageout_predictions'] += 1
+            if history.confidence < self.min_confidence:
+                self.stats['pageout_predictions_gated'] += 1
+
+    def pin(self, tensor):
+        if tensor.state == 'inactive':
+            self._remove_inactive(tensor)
+            self._record(tensor, False)
+        elif tensor.state == 'reclaimed':
+            if not self.allocate(tensor):
+                return False
+            self.stats['bytes_paged_in'] += tensor.size
+        tensor.state = 'active'
+        self._update_peak_active()
+        return True
+
+    def _record(self, tensor, reclaimed):
+        history = self.history[tensor.name]
+        if history.predicted:
+            self.stats['pageout_prediction_hits' if reclaimed else
+                       'pageout_prediction_wrong'] += 1
+        elif reclaimed:
+            self.stats['pageout_prediction_misses'] += 1
+        history.record(reclaimed)
+
+    def _remove_inactive(self, tensor):
+        del self.reclaim_list[tensor]
+        self.stats['bytes_inactive'] -= tensor.chunk.size
+
+    def _reclaim(self, tensor):
+        self._remove_inactive(tensor)
+        self._record(tensor, True)
+        self.stats['bytes_reclaimed'] += tensor.size
+        self._free_chunk(tensor.chunk)
+        tensor.chunk = None
+        tensor.state = 'reclaimed'
+
+    def _span(self, chunk):
+        span = chunk.size
+        for neighbor in (chunk.prev, chunk.next):
+            if neighbor is not None and neighbor.tensor is None:
+                span += neighbor.size
+        return span
+
+    def _reclaim_one(self, rounded_bytes):
+        # Best fit: the smallest reclaimable span, the oldest on ties.
+        victim = None
+        for tensor in self.reclaim_list:
+            span = self._span(tensor.chunk)
+            if span >= rounded_bytes and (
+                    victim is None or (span, tensor.seq) < victim[0]):
+                victim = ((span, tensor.seq), tensor)
+        if victim is None:
+            return False
+        self._reclaim(victim[1])
+        return True
+
+    def _reclaim_fragments(self, rounded_bytes):
+        # The run of adjacent free and inactive chunks that covers the
+        # request while reclaiming the fewest bytes.
+        best = None
+        run = []
+        chunk = self.chunks[0]
+        while chunk is not None:
+            if chunk.tensor is None or chunk.tensor.state == 'inactive':
+                run.append(chunk)
+            else:
+                best = self._find_fragment_run(run, rounded_bytes, best)
+                run = []
+            chunk = chunk.next
+        best = self._find_fragment_run(run, rounded_bytes, best)
+        if best is None:
+            return False
+        victims = [c.tensor for c in best[1] if c.tensor is not None]
+        if not victims:
+            return False
+        for tensor in victims:
+            self._reclaim(tensor)
+        return True
+
+    def _find_fragment_run(self, run, rounded_bytes, best):
+        begin = 0
+        total = 0
+        cost = 0
+        for end, chunk in enumerate(run):
+            total += chunk.size
+            if chunk.tensor is not None:
+                cost += chunk.size
+            while total - run[begin].size >= rounded_bytes:
+                total -= run[begin].size
+                if run[begin].tensor is not None:
+                    cost -= run[begin].size
+                begin += 1
+            if total >= rounded_bytes and (best is None or cost < best[0]):
+                best = (cost, run[begin:end + 1])
+        return best
+
+    def _reclaim_chunk(self, rounded_bytes):
+        while self.reclaim_list:
+            if self._reclaim_one(rounded_bytes):
+                self.stats['num_single_reclaims'] += 1
+            elif self._reclaim_fragments(rounded_bytes):
+                self.stats['num_fragment_reclaims'] += 1
+            else:
+                self.stats['num_full_reclaims'] += 1
+                for tensor in list(self.reclaim_list):
+                    self._reclaim(tensor)
+            chunk = self._find_chunk(rounded_bytes)
+            if chunk is not None:
+                return chunk
+        return None
+
+
+def tensor_size(tensor, batch_size):
+    if tensor.dtype in (tf.resource, tf.variant, tf.string):
+        return 0
+    shape = tensor.shape
+    if shape.rank is None:
+        return None
+    dims = [batch_size if d is None else d for d in shape.as_list()]
+    size = tensor.dtype.size
+    for d in dims:
+        size *= d
+    return size
+
+
+def build_schedule(args, image_size):
+    # Returns the resident bytes and the op schedule of a training step: a
+    # list of (inputs, outputs, frees) with tensors named by graph tensor
+    # name and sizes in bytes.
+    if args.channels_last:
+        tf.keras.backend.set_image_data_format('channels_last')
+        input_shape = (image_size, image_size, 3)
+    else:
+        tf.keras.backend.set_image_data_format('channels_first')
+        input_shape = (3, image_size, image_size)
+    num_classes = 15
+    tf.keras.backend.clear_session()
+    model = model_choices[args.model](weights=None, include_top=True,
+                                      input_shape=input_shape,
+                                      classes=num_classes)
+    loss_fn = tf.keras.losses.CategoricalCrossentropy()
+
+    @tf.function
+    def train_step(x, y):
+        with tf.GradientTape() as tape:
+            loss = loss_fn(y, model(x, training=True))
+        return tape.gradient(loss, model.trainable_variables)
+
+    graph = train_step.get_concrete_function(
+        tf.TensorSpec((args.batch_size,) + input_shape, tf.float32),
+        tf.TensorSpec((args.batch_size, num_classes), tf.float32)).graph
+
+    resident = sum(tensor_size(w, args.batch_size) for w in model.weights)
+    resident += args.optimizer_slots * sum(
+        tensor_size(w, args.batch_size) for w in model.trainable_weights)
+
+    # The buffer each tensor lives in, after following aliases. Variable
+    # reads, constants and tensors of unknown size are not tracked.
+    buffers = {}
+    sizes = {}
+    ops = []
+    for op in graph.get_operations():
+        if op.type in ALIAS_OPS and op.inputs:
+            source = buffers.get(op.inputs[0].name)
+            for output in op.outputs:
+                if source is not None:
+                    buffers[output.name] = source
+            ops.append(op)
+            continue
+        if op.type in ('Const', 'ReadVariableOp', 'VarHandleOp'):
+            continue
+        for output in op.outputs:
+            size = tensor_size(output, args.batch_size)
+            if size:
+                buffers[output.name] = output.name
+                sizes[output.name] = size
+        ops.append(op)
+
+    last_use = {}
+    op_inputs = []
+    for i, op in enumerate(ops):
+        inputs = []
+        for t in op.inputs:
+            buf = buffers.get(t.name)
+            if buf is not None and buf not in inputs:
+                inputs.append(buf)
+                last_use[buf] = i
+        op_inputs.append(inputs)
+    # The gradients are used by the optimizer after the step.
+    for t in graph.outputs:
+        buf = buffers.get(t.name)
+        if buf is not None:
+            last_use[buf] = len(ops)
+
+    frees = collections.defaultdict(list)
+    schedule = []
+    for i, op in enumerate(ops):
+        outputs = [(t.name, sizes[t.name]) for t in op.outputs
+                   if buffers.get(t.name) == t.name]
+        for name, _ in outputs:
+            frees[last_use.get(name, i)].append(name)
+        schedule.append((op_inputs[i], outputs, frees.pop(i, [])))
+    return resident, schedule, frees.pop(len(ops), [])
+
+
+def simulate(resident, schedule, step_frees, args):
+    allocator = BFCAllocatorModel(int(args.gpu_memory_gb * (1 << 30)),
+                                  lms_enabled=args.lms,
+                                  history_steps=args.pageout_history_steps,
+                                  match_tolerance=args.pageout_match_tolerance,
+                                  min_confidence=args.pageout_min_confidence)
+    if not allocator.allocate(Tensor('resident', resident)):
+        return allocator.stats, False
+
+    for step in range(args.steps):
+        # Like the allocator statistics callbacks, report the last step.
+        peaks = {k: allocator.stats[k] for k in ('peak_bytes_in_use',
+                                                 'peak_bytes_active')}
+        allocator.stats = collections.Counter(
+            bytes_in_use=allocator.stats['bytes_in_use'], **peaks)
+        tensors = {}
+        for name in allocator.history:
+            allocator.history[name].reset(allocator.history_steps)
+        for inputs, outputs, frees in schedule:
+            for name in inputs:
+                if not allocator.pin(tensors[name]):
+                    return allocator.stats, False
+            for name, size in outputs:
+                tensors[name] = Tensor(name, size)
+                if not allocator.allocate(tensors[name]):
+                    return allocator.stats, False
+            for name in frees:
+                allocator.free(tensors.pop(name))
+            for name in inputs + [name for name, _ in outputs]:
+                if name in tensors and allocator.lms_enabled:
+                    allocator.unpin(tensors[name])
+        for name in step_frees:
+            tensor = tensors.pop(name)
+            if tensor.state == 'reclaimed':
+                allocator.pin(tensor)
+            allocator.free(tensor)
+    return allocator.stats, True
+
+
+def run_simulation(args, image_size):
+    resident, schedule, step_frees = build_schedule(args, image_size)
+    stats, fits = simulate(resident, schedule, step_frees, args)
+    report = {k: stats[k] for k in REPORT_KEYS if k in stats}
+    report['image_size'] = image_size
+    report['fits'] = fits
+    for key in REPORT_KEYS:
+        report.setdefault(key, 0)
+    swapped = report['bytes_reclaimed'] + report['bytes_paged_in']
+    report['pcie_seconds'] = swapped / (args.bandwidth_gbs * 1e9)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', choices=list(model_choices.keys()),
+                        default='resnet50',
+                        help='What model to simulate. (Default resnet50)')
+    parser.add_argument('--image_size', type=int, nargs='+', default=[500],
+                        help='Dimension of one side of the square image to '
+                             'be generated. More than one size runs a sweep. '
+                             '(Default 500)')
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help='Batch size. (Default 1)')
+    parser.add_argument('--gpu_memory_gb', type=float, default=15.0,
+                        help='The GPU memory available to the TensorFlow '
+                             'allocator in GiB. (Default 15.0)')
+    parser.add_argument('--bandwidth_gbs', type=float, default=12.0,
+                        help='The host to GPU bandwidth in GB/s used to '
+                             'estimate the time spent swapping. '
+                             '(Default 12.0)')
+    parser.add_argument('--steps', type=int, default=2,
+                        help='Training steps to simulate, the statistics of '
+                             'the last one are reported. The page-out '
+                             'predictions need more than one. (Default 2)')
+    parser.add_argument('--optimizer_slots', type=int, default=1,
+                        help='The number of optimizer slots per trainable '
+                             'variable, 1 for RMSprop. (Default 1)')
+    parser.add_argument('--pageout_history_steps', type=int, default=1,
+                        help='The past steps page-outs are predicted from, '
+                             'like set_lms_pageout_history_steps. '
+                             '(Default 1)')
+    parser.add_argument('--pageout_match_tolerance', type=float, default=0.0,
+                        help='Like set_lms_pageout_match_tolerance. '
+                             '(Default 0.0)')
+    parser.add_argument('--pageout_min_confidence', type=float, default=0.0,
+                        help='Like set_lms_pageout_min_confidence. '
+                             '(Default 0.0)')
+    parser.add_argument('--output',
+                        help='A CSV file to write the results to.')
+    lms_group = parser.add_mutually_exclusive_group(required=False)
+    lms_group.add_argument('--lms', dest='lms', action='store_true',
+                           help='Simulate with LMS (Default)')
+    lms_group.add_argument('--no-lms', dest='lms', action='store_false',
+                           help='Simulate without LMS')
+    parser.set_defaults(lms=True)
+    ch_fl_group = parser.add_mutually_exclusive_group(required=False)
+    ch_fl_group.add_argument('--channels_last', dest='channels_last',
+                             action='store_true',
+                             help='Create the model and images with '
+                                  'channels last.')
+    ch_fl_group.add_argument('--no-channels_last', dest='channels_last',
+                             action='store_false',
+                             help='Create the model and images with '
+                                  'channels first. (Default)')
+    parser.set_defaults(channels_last=False)
+    args = parser.parse_args()
+
+    # Only the graph is needed, keep the model variables off the GPU.
+    tf.config.set_visible_devices([], 'GPU')
+
+    reports = []
+    for image_size in args.image_size:
+        report = run_simulation(args, image_size)
+        reports.append(report)
+        print(', '.join('%s: %s' % (k, report[k]) for k in REPORT_KEYS))
+
+    if args.output:
+        with open(args.output, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=REPORT_KEYS)
+            writer.writeheader()
+            writer.writerows(reports)
+
+if __name__ == "__main__":
+    main()
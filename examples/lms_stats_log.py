@@ -0,0 +1,373 @@
+# Copyright 2020. IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+# Buffered writing and loading of per-step LMS statistics logs.
+#
+# StepStatsWriter keeps the rows logged by the statistics callbacks in memory
+# and writes them from a background thread, so that a step never waits for
+# the file system. The logs are written as CSV or in a compact columnar
+# format. The columns of a log are those of its first row.
+#
+# A columnar log starts with a header: the magic LMSSTATS, the format version
+# and the number of columns, then the type and the name of each column. The
+# type is 'q' for int64, 'd' for float64 and 's' for a string. The rows follow
+# in blocks: a row count, the type of each column in the block, then the
+# values of each column in turn, little endian. The values of a string column
+# are the uint32 byte length of each value followed by the UTF-8 bytes of all
+# of them.
+#
+# The type of a column is chosen for each block from all of its values, so
+# that a float after ints or a missing value is never truncated: an int
+# column of a block with a float or a missing value is written as float64,
+# one with a string as strings. The type in the header is that of the first
+# block. Loading promotes a column whose blocks differ in the same way.
+#
+# load_step_stats reads either format into a dict of NumPy arrays or a
+# pandas DataFrame. Run as a script, this module converts columnar logs with
+# the same columns to one CSV file.
+#
+# Invocation example:
+#   python lms_stats_log.py --output stats.csv resnet50_lms_stats.bin
+
+import argparse
+import csv
+import struct
+import sys
+import threading
+
+import numpy as np
+
+HEADER = struct.Struct('<8sII')
+COLUMN = struct.Struct('<cH')
+BLOCK = struct.Struct('<I')
+MAGIC = b'LMSSTATS'
+VERSION = 3
+
+# The NumPy type and the value of missing entries of each column type. The
+# single character 'c' columns of version 1 logs are only read, as are the
+# missing ints of version 2 logs.
+_COLUMN_TYPES = {b'q': ('<i8', -1), b'd': ('<f8', float('nan')),
+                 b's': ('<u4', ''), b'c': ('S1', b'?')}
+
+FORMATS = ['csv', 'columnar']
+
+
+def _column_type(values, header_type=None):
+    # The narrowest of int64, float64 and string that holds all of the
+    # values, None being a missing value. A column missing from all of the
+    # rows of a block keeps the string type of its header.
+    if header_type == b's' and all(v is None for v in values):
+        return b's'
+    column_type = b'q'
+    for value in values:
+        if value is None or isinstance(value, (float, np.floating)):
+            column_type = b'd'
+        elif not isinstance(value, (int, np.integer)):
+            return b's'
+    return column_type
+
+
+class StepStatsWriter():
+    """Writes the rows of a statistics log from a background thread.
+
+    The rows are written when flush_rows of them are waiting, every
+    flush_secs seconds, and on flush or close. An error of the background
+    thread is raised by the next write, flush or close.
+
+    With append, the rows are added to an existing log of the same format
+    and keep its columns.
+    """
+
+    def __init__(self, filename, log_format='csv', flush_rows=1000,
+                 flush_secs=10.0, append=False):
+        if log_format not in FORMATS:
+            raise ValueError('Unknown statistics log format %s' % log_format)
+        self._filename = filename
+        self._format = log_format
+        self._flush_rows = flush_rows
+        self._flush_secs = flush_secs
+        self._columns = None
+        self._header_types = None
+        self._rows = []
+        self._pending = 0
+        self._closed = False
+        self._flushing = False
+        self._error = None
+        self._cond = threading.Condition()
+        if append:
+            self._read_header()
+        if self._columns is None:
+            # Truncate now so that an earlier log never shows through
+            open(filename, 'wb').close()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='StepStatsWriter')
+        self._thread.start()
+
+    def write(self, row):
+        with self._cond:
+            self._check_error()
+            if self._closed:
+                raise ValueError('%s is closed' % self._filename)
+            if self._columns is None:
+                self._columns = list(row)
+            self._rows.append(row)
+            self._pending += 1
+            if len(self._rows) >= self._flush_rows:
+                self._cond.notify()
+
+    def flush(self):
+        with self._cond:
+            self._flushing = True
+            self._cond.notify()
+            while self._pending and not self._error:
+                self._cond.wait()
+            self._check_error()
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self._check_error()
+
+    def _check_error(self):
+        if self._error:
+            error, self._error = self._error, None
+            raise error
+
+    def _read_header(self):
+        try:
+            with open(self._filename, 'rb') as f:
+                data = f.read(1 << 16)
+        except FileNotFoundError:
+            return
+        if not data:
+            return
+        if (self._format == 'columnar') != data.startswith(MAGIC):
+            raise ValueError('%s is not a %s log' %
+                             (self._filename, self._format))
+        if self._format == 'csv':
+            self._columns = next(csv.reader(
+                data.decode('utf-8').splitlines()[:1]))
+            return
+        (_, version, _) = HEADER.unpack_from(data, 0)
+        if version != VERSION:
+            raise ValueError('Cannot append to the version %d log %s' %
+                             (version, self._filename))
+        (columns, _) = _read_columns(data)
+        self._columns = [name for (name, _, _) in columns]
+        self._header_types = [column_type for (_, column_type, _) in columns]
+
+    def _run(self):
+        header_written = self._columns is not None
+        while True:
+            with self._cond:
+                if (not self._closed and not self._flushing and
+                        len(self._rows) < self._flush_rows):
+                    self._cond.wait(self._flush_secs)
+                rows, self._rows = self._rows, []
+                self._flushing = False
+                closed = self._closed
+            if rows:
+                try:
+                    types = self._block_types(rows)
+                    if not header_written:
+                        self._write_header(types)
+                        self._header_types = types
+                        header_written = True
+                    self._write_rows(rows, types)
+                except Exception as e:  # pylint: disable=broad-except
+                    with self._cond:
+                        self._error = e
+            with self._cond:
+                self._pending -= len(rows)
+                self._cond.notify_all()
+                if closed and not self._rows:
+                    return
+
+    def _write_header(self, types):
+        if self._format == 'csv':
+            with open(self._filename, 'a', newline='') as f:
+                csv.writer(f).writerow(self._columns)
+            return
+        header = [HEADER.pack(MAGIC, VERSION, len(self._columns))]
+        for (name, column_type) in zip(self._columns, types):
+            name = name.encode('utf-8')
+            header.append(COLUMN.pack(column_type, len(name)) + name)
+        with open(self._filename, 'ab') as f:
+            f.write(b''.join(header))
+
+    def _block_types(self, rows):
+        if self._format == 'csv':
+            return None
+        header_types = self._header_types or [None] * len(self._columns)
+        return [_column_type([row.get(name) for row in rows], header_type)
+                for (name, header_type) in zip(self._columns, header_types)]
+
+    def _write_rows(self, rows, types):
+        if self._format == 'csv':
+            with open(self._filename, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=self._columns,
+                                        extrasaction='ignore')
+                writer.writerows(rows)
+            return
+        block = [BLOCK.pack(len(rows)), b''.join(types)]
+        for (name, column_type) in zip(self._columns, types):
+            (dtype, missing) = _COLUMN_TYPES[column_type]
+            values = [row.get(name) for row in rows]
+            values = [missing if v is None else v for v in values]
+            if column_type == b's':
+                values = [str(v).encode('utf-8') for v in values]
+                block.append(np.array([len(v) for v in values],
+                                      dtype=dtype).tobytes())
+                block.extend(values)
+                continue
+            block.append(np.array(values, dtype=dtype).tobytes())
+        with open(self._filename, 'ab') as f:
+            f.write(b''.join(block))
+
+
+def _read_columns(data):
+    # The name, type and NumPy type of each column in the header of a
+    # columnar log, and the offset of its first block.
+    (_, _, num_columns) = HEADER.unpack_from(data, 0)
+    offset = HEADER.size
+    columns = []
+    for _ in range(num_columns):
+        (column_type, name_size) = COLUMN.unpack_from(data, offset)
+        offset += COLUMN.size
+        name = data[offset:offset + name_size].decode('utf-8')
+        offset += name_size
+        columns.append((name, column_type,
+                        np.dtype(_COLUMN_TYPES[column_type][0])))
+    return (columns, offset)
+
+
+def _load_columnar(filename):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    (magic, version, _) = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version not in (1, 2, VERSION):
+        raise ValueError('%s is not an LMS statistics log this script can '
+                         'read' % filename)
+    (columns, offset) = _read_columns(data)
+
+    blocks = {name: [] for (name, _, _) in columns}
+    while offset < len(data):
+        (num_rows,) = BLOCK.unpack_from(data, offset)
+        offset += BLOCK.size
+        block_columns = columns
+        if version >= 3:
+            block_columns = []
+            for (i, (name, _, _)) in enumerate(columns):
+                column_type = data[offset + i:offset + i + 1]
+                block_columns.append(
+                    (name, column_type,
+                     np.dtype(_COLUMN_TYPES[column_type][0])))
+            offset += len(columns)
+        for (name, column_type, dtype) in block_columns:
+            values = np.frombuffer(data, dtype=dtype, count=num_rows,
+                                   offset=offset)
+            offset += num_rows * dtype.itemsize
+            if column_type == b's':
+                strings = []
+                for size in values.tolist():
+                    strings.append(data[offset:offset + size].decode('utf-8'))
+                    offset += size
+                values = np.array(strings, dtype=str)
+            blocks[name].append(values)
+    stats = {}
+    for (name, column_type, dtype) in columns:
+        if column_type == b's':
+            dtype = np.dtype(str)
+        values = blocks[name]
+        if any(v.dtype.kind in 'SU' for v in values):
+            # A column with strings in any block is read as strings
+            values = [v.astype(str) for v in values]
+        # Blocks of ints and floats concatenate to floats
+        stats[name] = (np.concatenate(values) if values
+                       else np.empty(0, dtype=dtype))
+    return stats
+
+
+def _load_csv(filename):
+    with open(filename, newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader, [])
+        rows = list(reader)
+    stats = {}
+    for (i, name) in enumerate(columns):
+        values = [row[i] for row in rows]
+        try:
+            stats[name] = np.array(values, dtype=np.int64)
+        except ValueError:
+            try:
+                # Rows without the column have an empty entry
+                stats[name] = np.array([v or 'nan' for v in values],
+                                       dtype=np.float64)
+            except ValueError:
+                stats[name] = np.array(values)
+    return stats
+
+
+def load_step_stats(filename, as_dataframe=False):
+    """Loads a statistics log of either format.
+
+    Returns a dict of a NumPy array per column, in the order of the columns
+    in the log, or a pandas DataFrame if as_dataframe is True.
+    """
+    with open(filename, 'rb') as f:
+        columnar = f.read(len(MAGIC)) == MAGIC
+    stats = _load_columnar(filename) if columnar else _load_csv(filename)
+    if as_dataframe:
+        import pandas as pd
+        return pd.DataFrame(stats)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Converts columnar LMS statistics logs to CSV.')
+    parser.add_argument('--output', default='-',
+                        help='The CSV file to write. (Default stdout)')
+    parser.add_argument('logs', nargs='+',
+                        help='The statistics logs to convert.')
+    args = parser.parse_args()
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w',
+                                                     newline='')
+    try:
+        writer = csv.writer(out)
+        first_columns = None
+        for log in args.logs:
+            stats = load_step_stats(log)
+            columns = list(stats)
+            if first_columns is None:
+                first_columns = columns
+                writer.writerow(columns)
+            elif columns != first_columns:
+                # The rows of one log would be written under the header
+                # of another.
+                parser.error('the columns of %s differ from those of %s' %
+                             (log, args.logs[0]))
+            writer.writerows(zip(*(stats[c].tolist() for c in columns)))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main()
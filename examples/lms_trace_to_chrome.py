@@ -0,0 +1,131 @@
+# Copyright 2020. IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+# Converts the LMS event traces written by tf.experimental.dump_lms_trace to
+# the Chrome trace event format. Load the output in chrome://tracing or
+# https://ui.perfetto.dev to see the swapping of each GPU next to each other:
+# the copies on the host to device and device to host streams, the periods in
+# which tensors were inactive, and the reclaims, prefetches and host memory
+# tier moves.
+#
+# Invocation example:
+#   python lms_trace_to_chrome.py --output trace.json gpu0.bin gpu1.bin
+
+import argparse
+import json
+import struct
+
+HEADER = struct.Struct('<8sIIQQII')
+EVENT = struct.Struct('<QQqQIHH')
+MAGIC = b'LMSTRACE'
+
+EVENT_TYPES = {1: 'inactive', 2: 'active', 3: 'free', 4: 'reclaim',
+               5: 'prefetch', 6: 'pageout_start', 7: 'pageout_done',
+               8: 'pagein_start', 9: 'pagein_done', 10: 'demote',
+               11: 'compress', 12: 'promote'}
+
+STREAMS = {0: 'allocator', 1: 'compute', 2: 'host to device',
+           3: 'device to host', 4: 'host memory'}
+
+# The events that end a copy, mapped to the event that starts it
+COPY_END = {'pageout_done': 'pageout_start', 'pagein_done': 'pagein_start'}
+
+
+def read_trace(filename):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    (magic, version, record_size, num_events, num_dropped, name_size,
+     _) = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != 1 or record_size != EVENT.size:
+        raise ValueError('%s is not an LMS trace this script can read' %
+                         filename)
+    offset = HEADER.size
+    name = data[offset:offset + name_size].decode('utf-8')
+    offset += name_size
+    events = [EVENT.unpack_from(data, offset + i * EVENT.size)
+              for i in range(num_events)]
+    return name, num_dropped, events
+
+
+def convert_trace(pid, name, events):
+    trace = [{'ph': 'M', 'name': 'process_name', 'pid': pid,
+              'args': {'name': name}}]
+    for tid, stream in STREAMS.items():
+        trace.append({'ph': 'M', 'name': 'thread_name', 'pid': pid,
+                      'tid': tid, 'args': {'name': stream}})
+
+    copies = {}
+    prefetched = set()
+    for (micros, buf, graph_id, size, _, event_type, stream) in events:
+        kind = EVENT_TYPES.get(event_type, 'unknown')
+        args = {'buffer': '0x%x' % buf, 'graph_id': '0x%x' % graph_id,
+                'size': size}
+        if kind == 'prefetch':
+            prefetched.add(buf)
+        if kind in ('pageout_start', 'pagein_start'):
+            copies[(kind, buf)] = micros
+            continue
+        if kind in COPY_END:
+            start = copies.pop((COPY_END[kind], buf), None)
+            if start is None:
+                continue
+            copy = kind.split('_')[0]
+            if copy == 'pagein' and buf in prefetched:
+                prefetched.discard(buf)
+                copy = 'prefetch'
+            trace.append({'ph': 'X', 'name': copy, 'cat': 'lms', 'pid': pid,
+                          'tid': stream, 'ts': start,
+                          'dur': micros - start, 'args': args})
+            continue
+
+        # Inactive periods overlap each other, show them as async events.
+        if kind == 'inactive':
+            trace.append({'ph': 'b', 'name': 'inactive', 'cat': 'lms',
+                          'pid': pid, 'tid': stream, 'id': '0x%x' % buf,
+                          'ts': micros, 'args': args})
+            continue
+        if kind in ('active', 'free', 'reclaim'):
+            trace.append({'ph': 'e', 'name': 'inactive', 'cat': 'lms',
+                          'pid': pid, 'tid': stream, 'id': '0x%x' % buf,
+                          'ts': micros, 'args': {'end': kind}})
+        trace.append({'ph': 'i', 's': 't', 'name': kind, 'cat': 'lms',
+                      'pid': pid, 'tid': stream, 'ts': micros,
+                      'args': args})
+    return trace
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('traces', nargs='+',
+                        help='The LMS trace files to convert, one process '
+                             'per file.')
+    parser.add_argument('--output', default='lms_trace.json',
+                        help='The Chrome trace file to write. '
+                             '(Default lms_trace.json)')
+    args = parser.parse_args()
+
+    trace = []
+    for pid, filename in enumerate(args.traces):
+        name, num_dropped, events = read_trace(filename)
+        if num_dropped:
+            print('%s: %d older events were dropped, increase max_events '
+                  'to keep them' % (filename, num_dropped))
+        trace.extend(convert_trace(pid, '%s (%s)' % (name, filename), events))
+
+    with open(args.output, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+if __name__ == "__main__":
+    main()
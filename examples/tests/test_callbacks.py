@@ -0,0 +1,99 @@
+# Copyright 2020. IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import csv
+import types
+
+import pytest
+
+import lms_stats_log
+
+pytest.importorskip('tensorflow')
+
+# The callbacks load the CUDA profiler libraries and the estimator hooks of
+# the LMS builds when imported.
+try:
+    import callbacks
+except (ImportError, OSError) as e:
+    pytest.skip('callbacks cannot be imported: %s' % e,
+                allow_module_level=True)
+
+
+def test_allocator_stats_without_snapshot(monkeypatch):
+    # The getters of a 2.1.0 build: no get_allocator_stats and no
+    # fragment reclaims.
+    experimental = types.SimpleNamespace(
+        get_num_allocs=lambda gpu_id: 10,
+        get_num_single_reclaims=lambda gpu_id: 2,
+        get_num_full_reclaims=lambda gpu_id: 1,
+        get_bytes_reclaimed=lambda gpu_id: 1 << 30)
+    monkeypatch.setattr(callbacks, 'tf',
+                        types.SimpleNamespace(experimental=experimental))
+    lms_stats = callbacks.LMSStats()
+    assert lms_stats.get_allocator_snapshot() == {
+        'allocator_num_allocs': 10, 'allocator_num_single_reclaims': 2,
+        'allocator_num_full_reclaims': 1, 'allocator_bytes_reclaimed': 1 << 30}
+    stats = lms_stats.step_begin()
+    assert stats['reclaim_fragments'] == -1
+    assert stats['gib_reclaimed'] == 1.0
+
+
+def test_stats_logger_lifetime(tmp_path, monkeypatch):
+    experimental = types.SimpleNamespace(get_num_allocs=lambda gpu_id: 1)
+    monkeypatch.setattr(callbacks, 'tf',
+                        types.SimpleNamespace(experimental=experimental))
+    filename = str(tmp_path / 'stats.bin')
+    logger = callbacks.LMSStatsLogger(filename, log_format='columnar')
+
+    def fit():
+        logger.on_train_begin()
+        logger.on_train_batch_begin(0)
+        logger.on_train_batch_end(0)
+        # Validation
+        logger.on_test_begin()
+        logger.on_test_batch_begin(0)
+        logger.on_test_batch_end(0)
+        logger.on_test_end()
+        logger.on_train_end()
+
+    fit()
+    fit()
+    logger.on_test_begin()
+    logger.on_test_batch_begin(0)
+    logger.on_test_batch_end(0)
+    logger.on_test_end()
+    # predict() does not open the log
+    logger.on_predict_begin()
+    logger.on_predict_end()
+    stats = lms_stats_log.load_step_stats(filename)
+    assert stats['step type'].tolist() == ['t', 'v', 't', 'v', 'v']
+
+
+def test_stats_average_other_columns(tmp_path, monkeypatch):
+    experimental = types.SimpleNamespace(get_num_allocs=lambda gpu_id: 1)
+    monkeypatch.setattr(callbacks, 'tf',
+                        types.SimpleNamespace(experimental=experimental))
+    filename = str(tmp_path / 'average.csv')
+    with open(filename, 'w') as f:
+        f.write('image_size,old_stat\n100,7\n')
+    average = callbacks.LMSStatsAverage(filename, 500)
+    average.on_train_end()
+    average.on_train_end()
+    with open(filename, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [r['image_size'] for r in rows] == ['100', '500', '500']
+    assert [r['old_stat'] for r in rows] == ['7', '', '']
+    assert rows[0]['allocator_num_allocs'] == ''
+    assert rows[1]['allocator_num_allocs'] == '1'
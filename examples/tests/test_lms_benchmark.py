@@ -0,0 +1,52 @@
+# Copyright 2020. IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import argparse
+
+import lms_benchmark
+
+CONFIG = {'model': 'resnet50', 'image_size': 500, 'batch_size': 1,
+          'lms': True}
+
+
+def benchmark_args(repeats):
+    return argparse.Namespace(label='test', dry_run=False, repeats=repeats)
+
+
+def test_repeats(monkeypatch):
+    results = iter([(3.0, {'allocator_bytes_reclaimed': 10, 'name': 'a'}),
+                    (1.0, {'allocator_bytes_reclaimed': 30, 'name': 'b'}),
+                    (2.0, {'allocator_bytes_reclaimed': 20, 'name': 'c'})])
+
+    def run_training(args, config, output_dir):
+        (rate, stats) = next(results)
+        return rate, stats, None
+
+    monkeypatch.setattr(lms_benchmark, 'run_training', run_training)
+    entry = lms_benchmark.run_configuration(benchmark_args(3), CONFIG)
+    assert entry['status'] == 'ok'
+    assert entry['rates'] == [3.0, 1.0, 2.0]
+    assert entry[lms_benchmark.RATE_FIELD] == 2.0
+    assert [s['name'] for s in entry['repeat_stats']] == ['a', 'b', 'c']
+    assert entry['stats'] == {'allocator_bytes_reclaimed': 20, 'name': 'a'}
+
+
+def test_failed_repeat(monkeypatch):
+    results = iter([(1.0, {}, None), (None, None, 'timed out')])
+    monkeypatch.setattr(lms_benchmark, 'run_training',
+                        lambda args, config, output_dir: next(results))
+    entry = lms_benchmark.run_configuration(benchmark_args(2), CONFIG)
+    assert entry['status'] == 'failed'
+    assert entry['error'] == 'timed out'
@@ -0,0 +1,156 @@
+# Copyright 2020. IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import argparse
+
+import pytest
+
+# The simulator builds its schedules from TensorFlow graphs, the allocator
+# model tested here does not need a GPU.
+pytest.importorskip('tensorflow')
+
+import lms_simulator
+
+
+def allocate(allocator, name, size):
+    tensor = lms_simulator.Tensor(name, size)
+    assert allocator.allocate(tensor)
+    return tensor
+
+
+def free_chunks(allocator):
+    return [size for (size, _) in allocator.free_chunks]
+
+
+def test_split_and_coalesce():
+    allocator = lms_simulator.BFCAllocatorModel(4096)
+    a = allocate(allocator, 'a', 1000)
+    b = allocate(allocator, 'b', 100)
+    assert a.chunk.size == 1024
+    assert b.chunk.size == lms_simulator.MIN_ALLOCATION_SIZE
+    assert free_chunks(allocator) == [4096 - 1024 - 256]
+    allocator.free(a)
+    assert free_chunks(allocator) == [1024, 4096 - 1024 - 256]
+    allocator.free(b)
+    assert free_chunks(allocator) == [4096]
+    assert allocator.stats['bytes_in_use'] == 0
+    assert allocator.stats['peak_bytes_in_use'] == 1280
+
+
+def test_out_of_memory_without_lms():
+    allocator = lms_simulator.BFCAllocatorModel(1024, lms_enabled=False)
+    allocate(allocator, 'a', 1024)
+    assert not allocator.allocate(lms_simulator.Tensor('b', 256))
+
+
+def test_single_reclaim_best_fit():
+    allocator = lms_simulator.BFCAllocatorModel(2048)
+    b = allocate(allocator, 'b', 1024)
+    a = allocate(allocator, 'a', 512)
+    c = allocate(allocator, 'c', 512)
+    allocator.unpin(b)
+    allocator.unpin(a)
+    allocate(allocator, 'd', 512)
+    assert (a.state, b.state, c.state) == ('reclaimed', 'inactive', 'active')
+    assert allocator.stats['num_single_reclaims'] == 1
+    assert allocator.stats['bytes_reclaimed'] == 512
+    assert allocator.stats['bytes_inactive'] == 1024
+
+
+def test_fragment_reclaim():
+    # No single inactive tensor covers the request, two adjacent ones do.
+    allocator = lms_simulator.BFCAllocatorModel(1024)
+    a = allocate(allocator, 'a', 256)
+    b = allocate(allocator, 'b', 256)
+    c = allocate(allocator, 'c', 512)
+    allocator.unpin(a)
+    allocator.unpin(b)
+    allocator.unpin(c)
+    allocator.pin(c)
+    allocate(allocator, 'd', 512)
+    assert (a.state, b.state, c.state) == ('reclaimed', 'reclaimed', 'active')
+    assert allocator.stats['num_fragment_reclaims'] == 1
+    assert allocator.stats['num_single_reclaims'] == 0
+
+
+def test_page_in():
+    allocator = lms_simulator.BFCAllocatorModel(1024)
+    a = allocate(allocator, 'a', 1024)
+    allocator.unpin(a)
+    b = allocate(allocator, 'b', 1024)
+    assert a.state == 'reclaimed'
+    assert not allocator.pin(a)
+    allocator.unpin(b)
+    assert allocator.pin(a)
+    assert (a.state, b.state) == ('active', 'reclaimed')
+    assert allocator.stats['bytes_paged_in'] == 1024
+
+
+def test_history_prediction():
+    history = lms_simulator.ReclaimHistory()
+    for reclaimed in (True, True):
+        history.record(reclaimed)
+    history.reset(history_steps=1)
+    assert history.predict(match_tolerance=0.0)
+    history.record(False)
+    # The current step no longer matches the past one
+    assert not history.predict(match_tolerance=0.0)
+    assert history.predict(match_tolerance=1.0)
+
+
+def test_history_steps_vote():
+    history = lms_simulator.ReclaimHistory()
+    for step in ([False], [True], [True]):
+        for reclaimed in step:
+            history.record(reclaimed)
+        history.reset(history_steps=2)
+    # Only the last two steps are kept, both reclaimed
+    assert len(history.past) == 2
+    assert history.predict(match_tolerance=0.0)
+
+
+def simulate_args(lms, steps=2):
+    # 1 KiB of GPU memory
+    return argparse.Namespace(gpu_memory_gb=1024 / (1 << 30), lms=lms,
+                              steps=steps, pageout_history_steps=1,
+                              pageout_match_tolerance=0.0,
+                              pageout_min_confidence=0.0)
+
+
+# a is not used again in the step, c does not fit next to it and b.
+SCHEDULE = [([], [('a', 512)], []),
+            ([], [('b', 256)], []),
+            (['b'], [('c', 512)], [])]
+STEP_FREES = ['a', 'b', 'c']
+
+
+def test_simulate_without_lms():
+    stats, fits = lms_simulator.simulate(256, SCHEDULE, STEP_FREES,
+                                         simulate_args(lms=False))
+    assert not fits
+    assert stats['peak_bytes_in_use'] == 1024
+
+
+def test_simulate_with_lms():
+    stats, fits = lms_simulator.simulate(256, SCHEDULE, STEP_FREES,
+                                         simulate_args(lms=True))
+    assert fits
+    assert stats['bytes_in_use'] == 256
+    assert stats['num_single_reclaims'] == 2
+    assert stats['bytes_reclaimed'] == 1024
+    assert stats['bytes_paged_in'] == 1024
+    # The second step predicts the reclaims of the first
+    assert stats['pageout_predictions'] == 2
+    assert stats['pageout_prediction_hits'] == 2
@@ -0,0 +1,200 @@
+# Copyright 2020. IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import struct
+import sys
+
+import numpy as np
+import pytest
+
+import lms_stats_log
+
+
+ROWS = [{'step': 0, 'mode': 'train', 'bytes_in_use': 1 << 33, 'rate': 0.5},
+        {'step': 1, 'mode': 'test', 'bytes_in_use': 0, 'rate': 0.25},
+        {'step': 2, 'mode': 'largest_first', 'bytes_in_use': 7,
+         'rate': 1.0}]
+
+
+def write_log(filename, log_format, rows, **kwargs):
+    writer = lms_stats_log.StepStatsWriter(filename, log_format, **kwargs)
+    for row in rows:
+        writer.write(row)
+    writer.close()
+
+
+@pytest.mark.parametrize('log_format', lms_stats_log.FORMATS)
+def test_round_trip(tmp_path, log_format):
+    filename = str(tmp_path / 'stats')
+    # Several blocks, with the last one partial
+    write_log(filename, log_format, ROWS * 3, flush_rows=2)
+    stats = lms_stats_log.load_step_stats(filename)
+    assert list(stats) == ['step', 'mode', 'bytes_in_use', 'rate']
+    assert stats['step'].tolist() == [0, 1, 2] * 3
+    assert stats['mode'].tolist() == ['train', 'test', 'largest_first'] * 3
+    assert stats['bytes_in_use'].tolist() == [1 << 33, 0, 7] * 3
+    assert stats['rate'].tolist() == [0.5, 0.25, 1.0] * 3
+    assert stats['step'].dtype == np.int64
+    assert stats['rate'].dtype == np.float64
+
+
+@pytest.mark.parametrize('log_format', lms_stats_log.FORMATS)
+def test_missing_values(tmp_path, log_format):
+    filename = str(tmp_path / 'stats')
+    write_log(filename, log_format, [{'step': 0, 'rate': 0.5}, {'step': 1}])
+    stats = lms_stats_log.load_step_stats(filename)
+    assert stats['step'].tolist() == [0, 1]
+    assert stats['rate'][0] == 0.5
+    assert np.isnan(stats['rate'][1])
+
+
+@pytest.mark.parametrize('log_format', lms_stats_log.FORMATS)
+@pytest.mark.parametrize('flush_rows', [1, 1000])
+def test_type_changes(tmp_path, log_format, flush_rows):
+    # A float and a missing value after ints, a string after an int
+    filename = str(tmp_path / 'stats')
+    write_log(filename, log_format,
+              [{'step': 0, 'size': 1, 'mode': 2},
+               {'step': 1, 'size': 2.5, 'mode': 'test'},
+               {'step': 2, 'size': None}], flush_rows=flush_rows)
+    stats = lms_stats_log.load_step_stats(filename)
+    assert stats['step'].tolist() == [0, 1, 2]
+    assert stats['size'][:2].tolist() == [1.0, 2.5]
+    assert np.isnan(stats['size'][2])
+    assert stats['mode'][:2].tolist() == ['2', 'test']
+
+
+@pytest.mark.parametrize('log_format', lms_stats_log.FORMATS)
+def test_empty_log(tmp_path, log_format):
+    filename = str(tmp_path / 'stats')
+    open(filename, 'w').write('stale')
+    write_log(filename, log_format, [])
+    assert lms_stats_log.load_step_stats(filename) == {}
+
+
+def test_flush(tmp_path):
+    filename = str(tmp_path / 'stats')
+    writer = lms_stats_log.StepStatsWriter(filename, 'columnar',
+                                           flush_secs=3600)
+    writer.write(ROWS[0])
+    writer.flush()
+    assert lms_stats_log.load_step_stats(filename)['step'].tolist() == [0]
+    writer.write(ROWS[1])
+    writer.close()
+    assert lms_stats_log.load_step_stats(filename)['step'].tolist() == [0, 1]
+
+
+@pytest.mark.parametrize('log_format', lms_stats_log.FORMATS)
+def test_append(tmp_path, log_format):
+    filename = str(tmp_path / 'stats')
+    write_log(filename, log_format, ROWS[:1])
+    # The appended rows keep the columns of the log
+    write_log(filename, log_format, [dict(ROWS[1], extra=1), ROWS[2]],
+              append=True)
+    stats = lms_stats_log.load_step_stats(filename)
+    assert list(stats) == list(ROWS[0])
+    assert stats['step'].tolist() == [0, 1, 2]
+    assert stats['mode'].tolist() == ['train', 'test', 'largest_first']
+
+
+def test_append_new_log(tmp_path):
+    filename = str(tmp_path / 'stats')
+    write_log(filename, 'columnar', ROWS, append=True)
+    assert lms_stats_log.load_step_stats(filename)['step'].tolist() == [0, 1, 2]
+
+
+def test_append_other_format(tmp_path):
+    filename = str(tmp_path / 'stats')
+    write_log(filename, 'csv', ROWS)
+    with pytest.raises(ValueError):
+        lms_stats_log.StepStatsWriter(filename, 'columnar', append=True)
+
+
+def test_closed_writer(tmp_path):
+    writer = lms_stats_log.StepStatsWriter(str(tmp_path / 'stats'))
+    writer.close()
+    writer.close()
+    with pytest.raises(ValueError):
+        writer.write(ROWS[0])
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        lms_stats_log.StepStatsWriter(str(tmp_path / 'stats'), 'json')
+
+
+def test_version_1_log(tmp_path):
+    # Version 1 logs stored strings as a single character
+    filename = str(tmp_path / 'stats')
+    header = [lms_stats_log.HEADER.pack(lms_stats_log.MAGIC, 1, 2)]
+    for (column_type, name) in ((b'q', b'step'), (b'c', b'mode')):
+        header.append(lms_stats_log.COLUMN.pack(column_type, len(name)) +
+                      name)
+    block = (lms_stats_log.BLOCK.pack(2) + struct.pack('<2q', 4, 5) +
+             b'tv')
+    with open(filename, 'wb') as f:
+        f.write(b''.join(header) + block)
+    stats = lms_stats_log.load_step_stats(filename)
+    assert stats['step'].tolist() == [4, 5]
+    assert stats['mode'].tolist() == ['t', 'v']
+
+
+def test_version_2_log(tmp_path):
+    # Version 2 logs had one type per column, in the header
+    filename = str(tmp_path / 'stats')
+    header = [lms_stats_log.HEADER.pack(lms_stats_log.MAGIC, 2, 2)]
+    for (column_type, name) in ((b'q', b'step'), (b's', b'mode')):
+        header.append(lms_stats_log.COLUMN.pack(column_type, len(name)) +
+                      name)
+    block = (lms_stats_log.BLOCK.pack(2) + struct.pack('<2q', 4, 5) +
+             struct.pack('<2I', 5, 4) + b'traintest')
+    with open(filename, 'wb') as f:
+        f.write(b''.join(header) + block)
+    stats = lms_stats_log.load_step_stats(filename)
+    assert stats['step'].tolist() == [4, 5]
+    assert stats['mode'].tolist() == ['train', 'test']
+
+
+def convert(monkeypatch, *args):
+    monkeypatch.setattr(sys, 'argv', ['lms_stats_log.py'] + list(args))
+    lms_stats_log.main()
+
+
+def test_convert(tmp_path, monkeypatch):
+    logs = [str(tmp_path / name) for name in ('a.bin', 'b.bin')]
+    write_log(logs[0], 'columnar', ROWS[:1])
+    write_log(logs[1], 'columnar', ROWS[1:])
+    output = str(tmp_path / 'stats.csv')
+    convert(monkeypatch, '--output', output, *logs)
+    stats = lms_stats_log.load_step_stats(output)
+    assert list(stats) == list(ROWS[0])
+    assert stats['step'].tolist() == [0, 1, 2]
+
+
+def test_convert_different_columns(tmp_path, monkeypatch):
+    logs = [str(tmp_path / name) for name in ('a.bin', 'b.bin')]
+    write_log(logs[0], 'columnar', ROWS)
+    write_log(logs[1], 'columnar', [{'step': 3}])
+    with pytest.raises(SystemExit):
+        convert(monkeypatch, '--output', str(tmp_path / 'stats.csv'), *logs)
+
+
+def test_unknown_version(tmp_path):
+    filename = str(tmp_path / 'stats')
+    with open(filename, 'wb') as f:
+        f.write(lms_stats_log.HEADER.pack(lms_stats_log.MAGIC,
+                                          lms_stats_log.VERSION + 1, 0))
+    with pytest.raises(ValueError):
+        lms_stats_log.load_step_stats(filename)
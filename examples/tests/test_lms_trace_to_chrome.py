@@ -0,0 +1,92 @@
+# Copyright 2020. IBM All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import pytest
+
+import lms_trace_to_chrome as trace_to_chrome
+
+EVENT_IDS = {kind: event_type
+             for (event_type, kind) in trace_to_chrome.EVENT_TYPES.items()}
+
+
+def event(micros, kind, buf=0x100, stream=0, size=1024, graph_id=7):
+    return (micros, buf, graph_id, size, 0, EVENT_IDS[kind], stream)
+
+
+def write_trace(filename, name, events, num_dropped=0, version=1):
+    name = name.encode('utf-8')
+    data = [trace_to_chrome.HEADER.pack(trace_to_chrome.MAGIC, version,
+                                        trace_to_chrome.EVENT.size,
+                                        len(events), num_dropped, len(name),
+                                        0), name]
+    data.extend(trace_to_chrome.EVENT.pack(*e) for e in events)
+    with open(filename, 'wb') as f:
+        f.write(b''.join(data))
+
+
+def test_read_trace(tmp_path):
+    filename = str(tmp_path / 'gpu0.bin')
+    events = [event(10, 'inactive'), event(20, 'reclaim')]
+    write_trace(filename, 'GPU_0_bfc', events, num_dropped=3)
+    assert trace_to_chrome.read_trace(filename) == ('GPU_0_bfc', 3, events)
+
+
+@pytest.mark.parametrize('version', [0, 2])
+def test_read_trace_version(tmp_path, version):
+    filename = str(tmp_path / 'gpu0.bin')
+    write_trace(filename, 'GPU_0_bfc', [], version=version)
+    with pytest.raises(ValueError):
+        trace_to_chrome.read_trace(filename)
+
+
+def test_metadata():
+    trace = trace_to_chrome.convert_trace(2, 'GPU_0_bfc', [])
+    assert trace[0] == {'ph': 'M', 'name': 'process_name', 'pid': 2,
+                        'args': {'name': 'GPU_0_bfc'}}
+    threads = {e['tid']: e['args']['name'] for e in trace[1:]}
+    assert threads == trace_to_chrome.STREAMS
+
+
+def test_copies():
+    events = [event(10, 'pageout_start', stream=3),
+              event(25, 'pageout_done', stream=3),
+              event(30, 'prefetch', stream=0),
+              event(40, 'pagein_start', stream=2),
+              event(44, 'pagein_done', stream=2),
+              event(50, 'pagein_start', stream=2),
+              event(58, 'pagein_done', stream=2),
+              # The start of this copy was dropped
+              event(60, 'pageout_done', buf=0x200, stream=3)]
+    trace = trace_to_chrome.convert_trace(0, 'GPU_0_bfc', events)
+    copies = [(e['name'], e['tid'], e['ts'], e['dur'])
+              for e in trace if e['ph'] == 'X']
+    assert copies == [('pageout', 3, 10, 15), ('prefetch', 2, 40, 4),
+                      ('pagein', 2, 50, 8)]
+
+
+def test_inactive_periods():
+    events = [event(10, 'inactive', buf=0x100),
+              event(12, 'inactive', buf=0x200),
+              event(15, 'active', buf=0x100),
+              event(20, 'reclaim', buf=0x200)]
+    trace = trace_to_chrome.convert_trace(0, 'GPU_0_bfc', events)
+    periods = [(e['ph'], e['id'], e['ts']) for e in trace
+               if e['name'] == 'inactive']
+    assert periods == [('b', '0x100', 10), ('b', '0x200', 12),
+                       ('e', '0x100', 15), ('e', '0x200', 20)]
+    instants = [(e['name'], e['args']['buffer'], e['args']['size'])
+                for e in trace if e['ph'] == 'i']
+    assert instants == [('active', '0x100', 1024),
+                        ('reclaim', '0x200', 1024)]